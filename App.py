@@ -5,12 +5,21 @@ Flask приложение для чат-бота на основе Claude API.
 с поддержкой различных форматов вывода (текст, JSON, XML).
 """
 
+# Патчим стандартную библиотеку до импорта anthropic/httpx,
+# чтобы сетевые операции уступали управление циклу событий gevent
+from gevent import monkey
+monkey.patch_all()
+
+import atexit
+import hashlib
 import os
-import traceback
+import time
 from datetime import datetime
-from typing import Tuple, Dict, Any, List
+from typing import Tuple, Dict, Any, Iterator, List, Optional, Union
 
-from flask import Flask, request, jsonify, send_from_directory, Response
+import msgspec
+import orjson
+from flask import Flask, request, jsonify, Response
 from dotenv import load_dotenv
 
 from constants import (
@@ -20,17 +29,28 @@ from constants import (
     STATIC_FOLDER,
     STATIC_URL_PATH,
     INDEX_FILE,
+    INDEX_CACHE_MAX_AGE,
     HTTP_OK,
     HTTP_BAD_REQUEST,
     HTTP_INTERNAL_SERVER_ERROR,
     ERROR_EMPTY_MESSAGE,
-    MAX_TOKENS
+    ERROR_INVALID_REQUEST,
+    MIN_MAX_TOKENS,
+    MAX_MAX_TOKENS,
+    MIN_TEMPERATURE,
+    MAX_TEMPERATURE,
+    MIMETYPE_MSGPACK,
+    OUTPUT_FORMAT_DEFAULT,
+    VALID_OUTPUT_FORMATS,
+    VALID_MESSAGE_ROLES
 )
 from logger import setup_logging, get_logger
 from claude_client import ClaudeClient
 from token_counter import TokenCounter
 from prompts import get_system_prompt
 from history_compression import HistoryCompressor
+from json_provider import OrjsonProvider
+from schemas import ChatRequest
 
 # Загрузка переменных окружения
 load_dotenv()
@@ -41,70 +61,158 @@ logger = get_logger(__name__)
 
 # Инициализация Flask приложения
 app = Flask(__name__, static_folder=STATIC_FOLDER, static_url_path=STATIC_URL_PATH)
+app.json = OrjsonProvider(app)
+app.json.sort_keys = False
+app.json.ensure_ascii = False
+app.json.compact = True
+
+# Главная страница читается один раз при старте и отдаётся из памяти с ETag
+with open(os.path.join(app.static_folder, INDEX_FILE), 'rb') as index_file:
+    _INDEX_BYTES = index_file.read()
+_INDEX_ETAG = hashlib.md5(_INDEX_BYTES, usedforsecurity=False).hexdigest()
 
-# Инициализация Claude клиента и компрессора истории
+# Инициализация Claude клиента, счётчика токенов и компрессора истории
 claude_client = ClaudeClient()
+atexit.register(claude_client.close)
+_token_counter = TokenCounter()
 history_compressor = HistoryCompressor()
 
+# API ключ не меняется во время работы, поэтому проверяем его один раз
+_API_KEY_CONFIGURED = claude_client.is_api_key_configured()
+
+# Последняя отметка времени для /health: [unix time, ISO строка]
+_last_health_ts = [0.0, ""]
+
+# Декодеры запросов и энкодеры ответов
+_CHAT_DECODER = msgspec.json.Decoder(ChatRequest)
+_CHAT_MSGPACK_DECODER = msgspec.msgpack.Decoder(ChatRequest)
+_JSON_ENCODER = msgspec.json.Encoder()
+_MSGPACK_ENCODER = msgspec.msgpack.Encoder()
+
+
+def normalize_history(conversation_history: Any) -> List[Dict[str, str]]:
+    """
+    Проверяет историю диалога и приводит её к формату Claude API.
+
+    Выполняется один раз на запрос: оставляет только сообщения user/assistant
+    с непустым содержимым и только поля role и content.
+
+    Args:
+        conversation_history: История диалога из запроса
+
+    Returns:
+        Нормализованный список сообщений
+    """
+    if not isinstance(conversation_history, list):
+        return []
+    return [
+        {"role": msg['role'], "content": msg['content']}
+        for msg in conversation_history
+        if isinstance(msg, dict) and msg.get('role') in VALID_MESSAGE_ROLES and msg.get('content')
+    ]
+
 
 def build_messages(conversation_history: List[Dict[str, str]], user_message: str) -> List[Dict[str, str]]:
     """
     Формирует массив сообщений из истории и нового сообщения.
 
     Args:
-        conversation_history: История диалога
+        conversation_history: Нормализованная история диалога (см. normalize_history)
         user_message: Новое сообщение пользователя
 
     Returns:
         Список сообщений для API
     """
-    messages = []
-    for msg in conversation_history:
-        if msg.get('role') in ('user', 'assistant') and msg.get('content'):
-            messages.append({"role": msg['role'], "content": msg['content']})
-    messages.append({"role": "user", "content": user_message})
-    return messages
+    return [*conversation_history, {"role": "user", "content": user_message}]
 
 
-def validate_and_clamp(value: Any, default: Any, min_val: Any = None, max_val: Any = None, value_type: type = None) -> Any:
+def _clamp_max_tokens(value: int) -> int:
+    """Ограничивает max_tokens диапазоном MIN_MAX_TOKENS..MAX_MAX_TOKENS."""
+    if MIN_MAX_TOKENS <= value <= MAX_MAX_TOKENS:
+        return value
+    return MIN_MAX_TOKENS if value < MIN_MAX_TOKENS else MAX_MAX_TOKENS
+
+
+def _clamp_temperature(value: float) -> float:
+    """Ограничивает temperature диапазоном MIN_TEMPERATURE..MAX_TEMPERATURE."""
+    if MIN_TEMPERATURE <= value <= MAX_TEMPERATURE:
+        return value
+    return MIN_TEMPERATURE if value < MIN_TEMPERATURE else MAX_TEMPERATURE
+
+
+def _json_response(data: Dict[str, Any]) -> Response:
+    """Сериализует ответ через msgspec и упаковывает его в Response."""
+    return Response(_JSON_ENCODER.encode(data), mimetype='application/json')
+
+
+def _encode_response(data: Dict[str, Any]) -> Response:
     """
-    Валидирует и ограничивает значение в заданном диапазоне.
+    Сериализует ответ в формат, запрошенный клиентом через Accept.
 
     Args:
-        value: Значение для валидации
-        default: Значение по умолчанию
-        min_val: Минимальное значение
-        max_val: Максимальное значение
-        value_type: Ожидаемый тип значения (type или tuple типов)
+        data: Данные ответа
 
     Returns:
-        Валидированное значение
+        MessagePack ответ, если клиент предпочитает application/vnd.msgpack, иначе JSON
     """
-    # Проверяем тип
-    if value_type and not isinstance(value, value_type):
-        return default
-
-    # Применяем ограничения диапазона
-    if min_val is not None and max_val is not None:
-        clamped = max(min_val, min(max_val, value))
-        # Сохраняем исходный тип (int остаётся int)
-        return type(value)(clamped) if isinstance(value, (int, float)) else clamped
-
-    return value
+    if request.accept_mimetypes.best == MIMETYPE_MSGPACK:
+        return Response(_MSGPACK_ENCODER.encode(data), mimetype=MIMETYPE_MSGPACK)
+    return _json_response(data)
 
 
 @app.route('/')
 def index() -> Response:
     """Отдает главную страницу приложения."""
-    return send_from_directory(STATIC_FOLDER, INDEX_FILE)
+    # If-None-Match сравнивается слабо (RFC 9110): прокси со сжатием отдают W/"..."
+    if request.if_none_match.contains_weak(_INDEX_ETAG):
+        response = Response(status=304)
+    else:
+        response = Response(_INDEX_BYTES, mimetype='text/html')
+    response.set_etag(_INDEX_ETAG)
+    response.cache_control.public = True
+    response.cache_control.max_age = INDEX_CACHE_MAX_AGE
+    return response
 
 
-def validate_chat_request(data: Dict[str, Any]) -> Tuple[bool, str]:
-    """Валидирует данные запроса к /api/chat."""
-    if not data.get('message', '').strip():
+def _decode_chat_request() -> Tuple[Optional[ChatRequest], Optional[Tuple[Response, int]]]:
+    """
+    Декодирует и валидирует тело запроса к /api/chat и /api/chat_stream.
+
+    Returns:
+        Кортеж (запрос, None) или (None, ответ с ошибкой и HTTP кодом)
+    """
+    decoder = _CHAT_MSGPACK_DECODER if request.mimetype == MIMETYPE_MSGPACK else _CHAT_DECODER
+    raw = request.get_data(cache=False)
+    try:
+        req = decoder.decode(raw) if raw else ChatRequest()
+    except msgspec.DecodeError as e:
+        logger.warning("Некорректный запрос: %s", e)
+        return None, (_encode_response({'error': f'{ERROR_INVALID_REQUEST}: {e}'}), HTTP_BAD_REQUEST)
+
+    # Сообщение обрезается один раз: дальше get_user_message получает уже чистую строку
+    req.message = req.message.strip()
+    if not req.message:
         logger.warning("Получено пустое сообщение")
-        return False, ERROR_EMPTY_MESSAGE
-    return True, ""
+        return None, (_encode_response({'error': ERROR_EMPTY_MESSAGE}), HTTP_BAD_REQUEST)
+
+    return req, None
+
+
+def _compress_history(conversation_history: List[Dict[str, str]]) -> List[Dict[str, str]]:
+    """Сжимает историю диалога, если она достигла порога сжатия."""
+    if not history_compressor.should_compress(conversation_history):
+        return conversation_history
+
+    original_history_len = len(conversation_history)
+    logger.info("Начинаем сжатие истории (%d сообщений)...", original_history_len)
+    conversation_history = history_compressor.compress_history(conversation_history)
+    logger.info("История сжата: %d -> %d сообщений", original_history_len, len(conversation_history))
+    return conversation_history
+
+
+def _sse_event(data: Dict[str, Any]) -> bytes:
+    """Упаковывает данные в событие Server-Sent Events."""
+    return b"data: " + orjson.dumps(data) + b"\n\n"
 
 
 @app.route('/api/chat', methods=['POST'])
@@ -115,6 +223,9 @@ def chat() -> Tuple[Response, int]:
     Принимает сообщение пользователя и параметры настроек,
     отправляет запрос к Claude API и возвращает ответ.
 
+    Тело запроса принимается в JSON или MessagePack (Content-Type: application/vnd.msgpack),
+    формат ответа выбирается по заголовку Accept.
+
     Request JSON:
         message (str): Сообщение пользователя
         output_format (str, optional): Формат вывода ('default', 'json', 'xml')
@@ -123,33 +234,30 @@ def chat() -> Tuple[Response, int]:
         conversation_history (list, optional): История диалога
 
     Returns:
-        JSON ответ с полем 'reply' или 'error' и HTTP код статуса
+        JSON (или MessagePack) ответ с полем 'reply' или 'error' и HTTP код статуса
     """
     logger.info("Получен запрос на /api/chat")
 
-    # Получаем и валидируем данные запроса
-    data = request.get_json() or {}
-    is_valid, error_message = validate_chat_request(data)
-
-    if not is_valid:
-        return jsonify({'error': error_message}), HTTP_BAD_REQUEST
-
-    # Извлекаем и валидируем параметры
-    user_message = data.get('message', '')
-    output_format = data.get('output_format', 'default')
-    max_tokens = validate_and_clamp(data.get('max_tokens', MAX_TOKENS), MAX_TOKENS, 128, 4096, int)
-    temperature = validate_and_clamp(data.get('temperature', 1.0), 1.0, 0.0, 1.0, (int, float))
-    spec_mode = data.get('spec_mode', False) if isinstance(data.get('spec_mode'), bool) else False
-    conversation_history = data.get('conversation_history', []) if isinstance(data.get('conversation_history'), list) else []
-
-    logger.info(f"Параметры: format={output_format}, max_tokens={max_tokens}, spec_mode={spec_mode}, history_len={len(conversation_history)}, temperature={temperature}")
+    # Декодируем и валидируем данные запроса
+    req, error_response = _decode_chat_request()
+    if error_response:
+        return error_response
+
+    user_message = req.message
+    output_format = req.output_format
+    max_tokens = _clamp_max_tokens(req.max_tokens)
+    temperature = _clamp_temperature(req.temperature)
+    spec_mode = req.spec_mode
+    conversation_history = normalize_history(req.conversation_history)
+
+    logger.info(
+        "Параметры: format=%s, max_tokens=%d, spec_mode=%s, history_len=%d, temperature=%.2f",
+        output_format, max_tokens, spec_mode, len(conversation_history), temperature
+    )
 
     # Сжимаем историю при необходимости
     original_history_len = len(conversation_history)
-    if history_compressor.should_compress(conversation_history):
-        logger.info(f"Начинаем сжатие истории ({original_history_len} сообщений)...")
-        conversation_history = history_compressor.compress_history(conversation_history)
-        logger.info(f"История сжата: {original_history_len} -> {len(conversation_history)} сообщений")
+    conversation_history = _compress_history(conversation_history)
 
     # Отправляем запрос к Claude API
     reply, error, status_code, usage = claude_client.send_message(
@@ -163,7 +271,7 @@ def chat() -> Tuple[Response, int]:
 
     # Возвращаем результат
     if error:
-        return jsonify(error), status_code
+        return _encode_response(error), status_code
 
     # Формируем ответ с информацией о токенах и сжатой историей
     response_data = {'reply': reply}
@@ -178,39 +286,130 @@ def chat() -> Tuple[Response, int]:
     else:
         response_data['compression_applied'] = False
 
-    return jsonify(response_data), HTTP_OK
+    return _encode_response(response_data), HTTP_OK
+
+
+@app.route('/api/chat_stream', methods=['POST'])
+def chat_stream() -> Union[Response, Tuple[Response, int]]:
+    """
+    Потоковая версия /api/chat через Server-Sent Events.
+
+    Принимает тот же запрос, что и /api/chat, и отправляет ответ Claude
+    по мере генерации, не дожидаясь его завершения.
+
+    Returns:
+        Поток text/event-stream с событиями:
+        - {"delta": "..."} — очередной фрагмент ответа
+        - {"done": true, "usage": {...}, "compression_applied": ..., "compressed_history": [...]}
+          — завершение ответа (compressed_history только если история была сжата)
+        - {"error": "..."} — ошибка Claude API
+        При ошибке валидации — JSON ответ с полем 'error' и HTTP 400
+    """
+    logger.info("Получен запрос на /api/chat_stream")
+
+    req, error_response = _decode_chat_request()
+    if error_response:
+        return error_response
+
+    conversation_history = normalize_history(req.conversation_history)
+    original_history_len = len(conversation_history)
+    conversation_history = _compress_history(conversation_history)
+    compression_applied = len(conversation_history) != original_history_len
+
+    stream_params = {
+        'user_message': req.message,
+        'output_format': req.output_format,
+        'max_tokens': _clamp_max_tokens(req.max_tokens),
+        'spec_mode': req.spec_mode,
+        'conversation_history': conversation_history,
+        'temperature': _clamp_temperature(req.temperature)
+    }
+
+    def generate() -> Iterator[bytes]:
+        try:
+            with claude_client.stream_message(**stream_params) as stream:
+                for text_chunk in stream.text_stream:
+                    yield _sse_event({'delta': text_chunk})
+                final_message = stream.get_final_message()
+        except Exception as e:
+            _, error, _, _ = claude_client.handle_error(e)
+            yield _sse_event(error)
+            return
+
+        done_data = {
+            'done': True,
+            'usage': claude_client.extract_usage(final_message),
+            'compression_applied': compression_applied
+        }
+        if compression_applied:
+            done_data['compressed_history'] = conversation_history
+        yield _sse_event(done_data)
+
+    return Response(
+        generate(),
+        mimetype='text/event-stream',
+        headers={'Cache-Control': 'no-cache', 'X-Accel-Buffering': 'no'}
+    )
 
 
 @app.route('/api/count_tokens', methods=['POST'])
 def count_tokens() -> Tuple[Response, int]:
     """Подсчитывает количество токенов для сообщения."""
     try:
-        data = request.get_json() or {}
-        user_message = data.get('message', '').strip()
+        raw = request.get_data(cache=False)
+        data = orjson.loads(raw) if raw else {}
+        if not isinstance(data, dict) or not isinstance(data.get('message') or '', str):
+            logger.warning("Некорректный запрос: ожидается объект со строковым полем message")
+            return _encode_response({'error': ERROR_INVALID_REQUEST}), HTTP_BAD_REQUEST
+        user_message = (data.get('message') or '').strip()
 
         if not user_message:
             logger.warning("Пустое сообщение для подсчёта токенов")
-            return jsonify({'error': ERROR_EMPTY_MESSAGE}), HTTP_BAD_REQUEST
+            return _encode_response({'error': ERROR_EMPTY_MESSAGE}), HTTP_BAD_REQUEST
 
-        output_format = data.get('output_format', 'default')
+        output_format = data.get('output_format', OUTPUT_FORMAT_DEFAULT)
         spec_mode = data.get('spec_mode', False)
-        conversation_history = data.get('conversation_history', []) if isinstance(data.get('conversation_history'), list) else []
-
-        logger.info(f"Подсчёт токенов: format={output_format}, spec={spec_mode}, history_len={len(conversation_history)}")
+        # Типы проверяются так же, как msgspec проверяет ChatRequest в /api/chat
+        if not isinstance(output_format, str) or not isinstance(spec_mode, bool):
+            logger.warning("Некорректный запрос: output_format должен быть строкой, spec_mode — bool")
+            return _encode_response({'error': ERROR_INVALID_REQUEST}), HTTP_BAD_REQUEST
+        if output_format not in VALID_OUTPUT_FORMATS:
+            logger.warning("Неподдерживаемый формат: %s, используется default", output_format)
+            output_format = OUTPUT_FORMAT_DEFAULT
+        conversation_history = normalize_history(data.get('conversation_history'))
+
+        logger.info(
+            "Подсчёт токенов: format=%s, spec=%s, history_len=%d",
+            output_format, spec_mode, len(conversation_history)
+        )
 
         # Формируем системный промпт и сообщения
         system_prompt = get_system_prompt(output_format, spec_mode)
         messages = build_messages(conversation_history, user_message)
 
-        # Подсчитываем токены
-        input_tokens = TokenCounter().count_tokens(system_prompt=system_prompt, messages=messages)
+        # Подсчитываем токены той моделью, в которую /api/chat отправит запрос
+        model = ClaudeClient._pick_model(output_format, spec_mode, len(user_message))
+        input_tokens = _token_counter.count_tokens(system_prompt=system_prompt, messages=messages, model=model)
 
-        logger.info(f"Подсчитано: {input_tokens} токенов")
-        return jsonify({'input_tokens': input_tokens}), HTTP_OK
+        logger.info("Подсчитано: %d токенов", input_tokens)
+        return _encode_response({'input_tokens': input_tokens}), HTTP_OK
+
+    except orjson.JSONDecodeError as e:
+        logger.warning("Некорректный запрос: %s", e)
+        return _encode_response({'error': f'{ERROR_INVALID_REQUEST}: {e}'}), HTTP_BAD_REQUEST
 
     except Exception as e:
-        logger.error(f"Ошибка подсчёта токенов: {e}\n{traceback.format_exc()}")
-        return jsonify({'error': str(e)}), HTTP_INTERNAL_SERVER_ERROR
+        logger.exception("Ошибка подсчёта токенов: %s", e)
+        return _encode_response({'error': str(e)}), HTTP_INTERNAL_SERVER_ERROR
+
+
+def _cached_iso_timestamp() -> str:
+    """Возвращает текущее время в ISO формате, обновляя его не чаще раза в секунду."""
+    now = time.time()
+    if now - _last_health_ts[0] >= 1.0:
+        _last_health_ts[0] = now
+        _last_health_ts[1] = datetime.fromtimestamp(now).isoformat()
+    return _last_health_ts[1]
 
 
 @app.route('/health')
@@ -219,8 +418,8 @@ def health() -> Tuple[Response, int]:
     try:
         return jsonify({
             'status': 'ok',
-            'timestamp': datetime.now().isoformat(),
-            'api_key_configured': claude_client.is_api_key_configured()
+            'timestamp': _cached_iso_timestamp(),
+            'api_key_configured': _API_KEY_CONFIGURED
         }), HTTP_OK
     except Exception as e:
         logger.error(f"Ошибка в /health: {e}")
@@ -5,17 +5,55 @@
 включая отправку запросов и обработку ответов.
 """
 
+import asyncio
+import atexit
+import logging
 import os
-import traceback
-from typing import Dict, Tuple, Optional, List
+import time
+from concurrent.futures import ThreadPoolExecutor
+from contextlib import asynccontextmanager, contextmanager
+from functools import partial
+from typing import Any, AsyncIterator, Dict, Iterator, Tuple, Optional, List
 
-from anthropic import Anthropic, APIError, APIConnectionError, RateLimitError, AuthenticationError
+import httpx
+from anthropic import (
+    Anthropic,
+    AsyncAnthropic,
+    APIError,
+    APIConnectionError,
+    RateLimitError,
+    AuthenticationError,
+    InternalServerError
+)
+from anthropic.lib.streaming import AsyncMessageStream, MessageStream
+from tenacity import RetryCallState, retry, retry_if_exception_type, stop_after_attempt, wait_exponential
 
 from constants import (
     CLAUDE_MODEL,
+    CLAUDE_FAST_MODEL,
+    FAST_MODEL_MAX_MESSAGE_LENGTH,
     MAX_TOKENS,
+    PROMPT_CACHING_BETA,
+    CLAUDE_CONNECT_TIMEOUT,
+    CLAUDE_READ_TIMEOUT,
+    CLAUDE_WRITE_TIMEOUT,
+    CLAUDE_POOL_TIMEOUT,
+    CLAUDE_MAX_CONNECTIONS,
+    CLAUDE_MAX_KEEPALIVE_CONNECTIONS,
+    CLAUDE_KEEPALIVE_EXPIRY,
+    CLAUDE_RETRY_ATTEMPTS,
+    CLAUDE_RETRY_MIN_WAIT,
+    CLAUDE_RETRY_MAX_WAIT,
+    RATE_LIMIT_WARNING_RATIO,
+    CLAUDE_REQUESTS_PER_MINUTE,
+    CLAUDE_TOKENS_PER_MINUTE,
+    CHARS_PER_TOKEN_ESTIMATE,
+    CLAUDE_MAX_CONCURRENCY,
+    MESSAGE_BATCH_POLL_INTERVAL,
+    MESSAGE_BATCH_MAX_WAIT,
     OUTPUT_FORMAT_DEFAULT,
     VALID_OUTPUT_FORMATS,
+    VALID_MESSAGE_ROLES,
     MAX_REPLY_LOG_LENGTH,
     ERROR_INVALID_API_KEY,
     ERROR_RATE_LIMIT,
@@ -24,13 +62,180 @@ from constants import (
     ERROR_API_KEY_NOT_FOUND,
     HTTP_TOO_MANY_REQUESTS,
     HTTP_INTERNAL_SERVER_ERROR,
-    HTTP_SERVICE_UNAVAILABLE
+    HTTP_SERVICE_UNAVAILABLE,
+    HTTP_GATEWAY_TIMEOUT
 )
 from prompts import get_system_prompt, get_user_message, SPEC_END_MARKER
-from logger import get_logger
+from rate_limiter import TokenBucket
+from response_cache import ResponseCache
+from logger import get_logger, preview
 
 logger = get_logger(__name__)
 
+# Замена переносов строк пробелами в превью сообщений для лога (один проход str.translate)
+_NEWLINE_TABLE = str.maketrans({'\n': ' ', '\r': ' '})
+
+# Общие настройки HTTP пула для синхронного и асинхронного клиентов
+_HTTP_TIMEOUT = httpx.Timeout(
+    connect=CLAUDE_CONNECT_TIMEOUT,
+    read=CLAUDE_READ_TIMEOUT,
+    write=CLAUDE_WRITE_TIMEOUT,
+    pool=CLAUDE_POOL_TIMEOUT
+)
+_HTTP_LIMITS = httpx.Limits(
+    max_connections=CLAUDE_MAX_CONNECTIONS,
+    max_keepalive_connections=CLAUDE_MAX_KEEPALIVE_CONNECTIONS,
+    keepalive_expiry=CLAUDE_KEEPALIVE_EXPIRY
+)
+
+# Общие Anthropic клиенты (и их пулы соединений) по API ключу
+_CLIENT_CACHE: Dict[str, Anthropic] = {}
+
+
+def get_anthropic_client(api_key: str) -> Anthropic:
+    """
+    Возвращает общий синхронный Anthropic клиент для API ключа.
+
+    Все модули с одинаковым ключом используют один экземпляр клиента
+    и один пул keep-alive соединений вместо собственных.
+
+    Args:
+        api_key: API ключ Anthropic
+
+    Returns:
+        Экземпляр Anthropic клиента
+    """
+    client = _CLIENT_CACHE.get(api_key)
+    if client is None:
+        client = _CLIENT_CACHE.setdefault(api_key, Anthropic(
+            api_key=api_key,
+            default_headers={"anthropic-beta": PROMPT_CACHING_BETA},
+            http_client=httpx.Client(http2=True, timeout=_HTTP_TIMEOUT, limits=_HTTP_LIMITS)
+        ))
+    return client
+
+
+def close_anthropic_clients() -> None:
+    """
+    Закрывает общие Anthropic клиенты и их пулы соединений.
+
+    Общими клиентами пользуются все ClaudeClient, TokenCounter и
+    HistoryCompressor процесса, поэтому они закрываются только здесь,
+    один раз при завершении процесса (функция зарегистрирована в atexit).
+    """
+    while _CLIENT_CACHE:
+        _, client = _CLIENT_CACHE.popitem()
+        client.close()
+    logger.info("Общие Anthropic клиенты закрыты")
+
+
+atexit.register(close_anthropic_clients)
+
+
+# Ошибки, после которых запрос к Claude API имеет смысл повторить
+_RETRYABLE_ERRORS = (RateLimitError, APIConnectionError, InternalServerError)
+_exponential_wait = wait_exponential(multiplier=1, min=CLAUDE_RETRY_MIN_WAIT, max=CLAUDE_RETRY_MAX_WAIT)
+
+
+def _wait_retry_after(retry_state: RetryCallState) -> float:
+    """
+    Вычисляет паузу перед повтором запроса.
+
+    Берёт экспоненциальную паузу, но не меньше значения заголовка retry-after,
+    если API его вернул.
+
+    Args:
+        retry_state: Состояние tenacity для текущей попытки
+
+    Returns:
+        Пауза в секундах
+    """
+    wait = _exponential_wait(retry_state)
+    response = getattr(retry_state.outcome.exception(), 'response', None)
+    retry_after = response.headers.get('retry-after') if response is not None else None
+    if retry_after:
+        try:
+            wait = max(wait, min(float(retry_after), CLAUDE_RETRY_MAX_WAIT))
+        except ValueError:
+            pass
+    return wait
+
+
+def _log_retry(retry_state: RetryCallState) -> None:
+    """Логирует повтор запроса к Claude API."""
+    logger.warning(
+        "Повтор запроса к Claude API (попытка %d из %d) через %.1f с: %s",
+        retry_state.attempt_number + 1, CLAUDE_RETRY_ATTEMPTS,
+        retry_state.next_action.sleep, retry_state.outcome.exception()
+    )
+
+
+_retry_policy = retry(
+    retry=retry_if_exception_type(_RETRYABLE_ERRORS),
+    wait=_wait_retry_after,
+    stop=stop_after_attempt(CLAUDE_RETRY_ATTEMPTS),
+    before_sleep=_log_retry,
+    reraise=True
+)
+
+
+def _estimate_tokens(api_params: Dict[str, Any]) -> int:
+    """
+    Грубо оценивает расход токенов запроса для ограничителя TPM.
+
+    Args:
+        api_params: Параметры messages.create
+
+    Returns:
+        Оценка входных токенов сообщений плюс max_tokens ответа
+    """
+    chars = 0
+    for msg in api_params['messages']:
+        content = msg['content']
+        if isinstance(content, str):
+            chars += len(content)
+        else:
+            chars += sum(len(block.get('text', '')) for block in content)
+    return chars // CHARS_PER_TOKEN_ESTIMATE + api_params['max_tokens']
+
+
+def _with_cache_control(msg: Dict[str, Any]) -> Dict[str, Any]:
+    """
+    Возвращает копию сообщения, последний блок которого помечен cache_control.
+
+    Args:
+        msg: Сообщение истории с content-строкой или списком блоков
+
+    Returns:
+        Новое сообщение; исходное и его блоки не изменяются
+    """
+    content = msg['content']
+    if isinstance(content, str):
+        blocks = [{"type": "text", "text": content}]
+    else:
+        blocks = [dict(block) for block in content]
+    blocks[-1]["cache_control"] = {"type": "ephemeral"}
+    return {"role": msg['role'], "content": blocks}
+
+
+def _used_tokens(usage: Any) -> int:
+    """Возвращает число токенов, которое запрос засчитал в лимит TPM по его usage."""
+    return (
+        usage.input_tokens + usage.output_tokens
+        + (getattr(usage, 'cache_creation_input_tokens', None) or 0)
+    )
+
+
+def _header_int(headers: httpx.Headers, name: str) -> Optional[int]:
+    """Возвращает целочисленное значение заголовка или None, если его нет или он некорректен."""
+    value = headers.get(name)
+    if not value:
+        return None
+    try:
+        return int(value)
+    except ValueError:
+        return None
+
 
 class ClaudeClient:
     """
@@ -38,6 +243,11 @@ class ClaudeClient:
     
     Attributes:
         client: Экземпляр Anthropic клиента
+        async_client: Экземпляр AsyncAnthropic клиента с HTTP/2 пулом соединений
+        response_cache: Кэш ответов на повторяющиеся детерминированные запросы
+        rate_limiters: Ограничители RPM и TPM по моделям
+        rate_limit_share: Доля лимитов аккаунта, доступная этому процессу (1 / WEB_CONCURRENCY)
+        executor: Пул потоков для параллельных вызовов send_many
         api_key: API ключ для аутентификации
     """
     
@@ -60,29 +270,33 @@ class ClaudeClient:
         logger.info(f"API ключ загружен: {self.api_key[:10]}...{self.api_key[-4:] if len(self.api_key) > 14 else ''}")
         
         try:
-            self.client = Anthropic(api_key=self.api_key)
+            # Встроенные повторы SDK отключены: повторы выполняет _retry_policy.
+            # with_options создаёт копию клиента поверх того же пула соединений
+            self.client = get_anthropic_client(self.api_key).with_options(max_retries=0)
+            self.async_client = AsyncAnthropic(
+                api_key=self.api_key,
+                max_retries=0,
+                default_headers={"anthropic-beta": PROMPT_CACHING_BETA},
+                http_client=httpx.AsyncClient(http2=True, timeout=_HTTP_TIMEOUT, limits=_HTTP_LIMITS)
+            )
+            self.response_cache = ResponseCache()
+            self.rate_limiters: Dict[str, Tuple[TokenBucket, TokenBucket]] = {}
+            # Лимиты аккаунта общие для всех воркеров gunicorn, поэтому делятся между ними
+            self.rate_limit_share = 1 / max(1, int(os.environ.get("WEB_CONCURRENCY", 1)))
+            self.executor = ThreadPoolExecutor(
+                max_workers=int(os.environ.get("CLAUDE_MAX_CONCURRENCY", CLAUDE_MAX_CONCURRENCY)),
+                thread_name_prefix="claude"
+            )
             logger.info("Anthropic клиент успешно инициализирован")
         except Exception as e:
             logger.error(f"Ошибка инициализации Anthropic клиента: {str(e)}")
             raise
     
-    def validate_output_format(self, output_format: str) -> bool:
-        """
-        Проверяет валидность формата вывода.
-        
-        Args:
-            output_format: Формат вывода для проверки
-            
-        Returns:
-            True если формат валиден, False иначе
-        """
-        return output_format in VALID_OUTPUT_FORMATS
-    
     def send_message(
         self,
         user_message: str,
         output_format: str = OUTPUT_FORMAT_DEFAULT,
-        model: str = CLAUDE_MODEL,
+        model: Optional[str] = None,
         max_tokens: int = MAX_TOKENS,
         spec_mode: bool = False,
         conversation_history: Optional[List[Dict[str, str]]] = None,
@@ -94,7 +308,7 @@ class ClaudeClient:
         Args:
             user_message: Сообщение пользователя
             output_format: Формат вывода ('default', 'json', 'xml')
-            model: Модель Claude для использования
+            model: Модель Claude. Если None, выбирается по сложности запроса (см. _pick_model)
             max_tokens: Максимальное количество токенов в ответе
             spec_mode: Режим сбора уточняющих данных (True/False)
             conversation_history: История диалога (список сообщений с role и content)
@@ -105,112 +319,678 @@ class ClaudeClient:
             - ответ: Текст ответа от Claude или None при ошибке
             - ошибка: Словарь с описанием ошибки или None при успехе
             - HTTP код: Код статуса HTTP
-            - usage: Словарь с информацией о токенах (input_tokens, output_tokens) или None
+            - usage: Словарь с информацией о токенах (input_tokens, output_tokens) и моделью (model) или None
+        """
+        try:
+            api_params = self._build_api_params(
+                user_message, output_format, model, max_tokens,
+                spec_mode, conversation_history, temperature
+            )
+
+            cache_key = self._response_cache_key(api_params, spec_mode, temperature)
+            cached = self._get_cached_result(cache_key)
+            if cached:
+                return cached
+
+            # Отправляем запрос к API
+            message = self._create(api_params)
+
+            return self._store_result(cache_key, self._build_result(message))
+
+        except Exception as e:
+            return self.handle_error(e)
+
+    async def asend_message(
+        self,
+        user_message: str,
+        output_format: str = OUTPUT_FORMAT_DEFAULT,
+        model: Optional[str] = None,
+        max_tokens: int = MAX_TOKENS,
+        spec_mode: bool = False,
+        conversation_history: Optional[List[Dict[str, str]]] = None,
+        temperature: float = 1.0
+    ) -> Tuple[Optional[str], Optional[Dict], int, Optional[Dict]]:
+        """
+        Асинхронная версия send_message.
+
+        Запрос уходит через AsyncAnthropic поверх HTTP/2 пула соединений,
+        поэтому параллельные вызовы из одного цикла событий мультиплексируются
+        по уже открытым соединениям:
+        `await asyncio.gather(*[client.asend_message(m) for m in messages])`.
+
+        Args и Returns совпадают с send_message.
         """
         try:
-            # Валидация формата
-            if not self.validate_output_format(output_format):
-                logger.warning(f"Неподдерживаемый формат: {output_format}, используется default")
-                output_format = OUTPUT_FORMAT_DEFAULT
-
-            # Получаем системный промпт
-            try:
-                system_prompt = get_system_prompt(output_format, spec_mode)
-            except ValueError as e:
-                logger.error(f"Ошибка получения системного промпта: {str(e)}")
-                return None, {'error': str(e)}, HTTP_INTERNAL_SERVER_ERROR, None
-
-            # Получаем чистое сообщение пользователя
-            clean_user_message = get_user_message(user_message)
-
-            # Формируем массив сообщений с историей
-            messages = []
-
-            # Добавляем историю диалога (если есть)
-            if conversation_history:
-                for msg in conversation_history:
-                    if msg.get('role') in ('user', 'assistant') and msg.get('content'):
-                        messages.append({
-                            "role": msg['role'],
-                            "content": msg['content']
-                        })
-
-            # Добавляем текущее сообщение пользователя
-            messages.append({
-                "role": "user",
-                "content": clean_user_message
-            })
-
-            # Формируем параметры запроса
-            api_params = {
-                "model": model,
-                "max_tokens": max_tokens,
-                "system": system_prompt,
-                "messages": messages,
-                "temperature": temperature
-            }
-
-            # Добавляем stop_sequences для spec mode
-            if spec_mode: api_params["stop_sequences"] = [SPEC_END_MARKER]
-
-            # === Детальное логирование параметров API запроса ===
+            api_params = self._build_api_params(
+                user_message, output_format, model, max_tokens,
+                spec_mode, conversation_history, temperature
+            )
+
+            cache_key = self._response_cache_key(api_params, spec_mode, temperature)
+            cached = self._get_cached_result(cache_key)
+            if cached:
+                return cached
+
+            # Отправляем запрос к API
+            message = await self._acreate(api_params)
+
+            return self._store_result(cache_key, self._build_result(message))
+
+        except Exception as e:
+            return self.handle_error(e)
+
+    async def send_many(
+        self,
+        items: List[Dict[str, Any]]
+    ) -> List[Tuple[Optional[str], Optional[Dict], int, Optional[Dict]]]:
+        """
+        Параллельно отправляет несколько сообщений через send_message.
+
+        Вызовы выполняются в пуле потоков executor, поэтому одновременно
+        к API уходит не больше CLAUDE_MAX_CONCURRENCY запросов, а общее
+        время близко к времени самого долгого запроса, а не к их сумме.
+        Из синхронного кода: `asyncio.run(client.send_many(items))`.
+
+        Args:
+            items: Список словарей с аргументами send_message
+
+        Returns:
+            Список кортежей (ответ, ошибка, HTTP код, usage) в порядке items
+        """
+        loop = asyncio.get_running_loop()
+        return await asyncio.gather(*(
+            loop.run_in_executor(self.executor, partial(self.send_message, **item))
+            for item in items
+        ))
+
+    def send_batch(
+        self,
+        items: List[Dict[str, Any]],
+        poll_interval: float = MESSAGE_BATCH_POLL_INTERVAL,
+        max_wait: float = MESSAGE_BATCH_MAX_WAIT
+    ) -> Dict[str, Tuple[Optional[str], Optional[Dict], int, Optional[Dict]]]:
+        """
+        Отправляет пакет сообщений через Message Batches API.
+
+        Пакетные запросы стоят на 50% дешевле и не расходуют RPM/TPM лимиты,
+        но обрабатываются до 24 часов. Метод блокируется, пока пакет
+        не будет обработан, поэтому подходит для фоновых задач, а не для
+        обработчиков HTTP запросов.
+
+        Каждое обращение к API повторяется при 429/5xx и сетевых ошибках.
+        Если пакет не обработан за max_wait или API так и не ответил,
+        пакет продолжает выполняться на сервере: ошибки содержат batch_id,
+        по которому результаты можно забрать позже через get_batch_results.
+
+        Args:
+            items: Список словарей с аргументами send_message и необязательным
+                   ключом custom_id (по умолчанию 'request-<индекс>')
+            poll_interval: Пауза между проверками статуса пакета (секунды)
+            max_wait: Максимальное время ожидания обработки пакета (секунды)
+
+        Returns:
+            Словарь custom_id -> кортеж (ответ, ошибка, HTTP код, usage) в формате send_message
+        """
+        requests = []
+        for index, item in enumerate(items):
+            params = dict(item)
+            custom_id = params.pop('custom_id', f'request-{index}')
+            requests.append({"custom_id": custom_id, "params": self._build_api_params(**params)})
+
+        batch_id = None
+        try:
+            batches = self.client.beta.messages.batches
+            batch = self._call_api(batches.create, requests=requests, betas=[PROMPT_CACHING_BETA])
+            batch_id = batch.id
+            logger.info("Пакет %s создан: %d запросов", batch_id, len(requests))
+
+            deadline = time.monotonic() + max_wait
+            while batch.processing_status != 'ended':
+                remaining = deadline - time.monotonic()
+                if remaining <= 0:
+                    logger.warning(
+                        "Пакет %s не обработан за %s с, результаты можно получить позже через get_batch_results",
+                        batch_id, max_wait
+                    )
+                    error_result = (
+                        None,
+                        {'error': f'Пакет {batch_id} ещё обрабатывается', 'batch_id': batch_id},
+                        HTTP_GATEWAY_TIMEOUT,
+                        None
+                    )
+                    return {request["custom_id"]: error_result for request in requests}
+                time.sleep(min(poll_interval, remaining))
+                batch = self._call_api(batches.retrieve, batch_id)
+            logger.info("Пакет %s обработан: %s", batch_id, batch.request_counts)
+
+            return self.get_batch_results(batch_id)
+
+        except Exception as e:
+            _, error, status, _ = self.handle_error(e)
+            if batch_id is not None:
+                logger.error("Не удалось получить результаты пакета %s, он продолжает выполняться на сервере", batch_id)
+                error = {**error, 'batch_id': batch_id}
+            return {request["custom_id"]: (None, error, status, None) for request in requests}
+
+    def get_batch_results(self, batch_id: str) -> Dict[str, Tuple[Optional[str], Optional[Dict], int, Optional[Dict]]]:
+        """
+        Забирает результаты обработанного пакета Message Batches API.
+
+        Args:
+            batch_id: Идентификатор пакета (из send_batch или его ошибок)
+
+        Returns:
+            Словарь custom_id -> кортеж (ответ, ошибка, HTTP код, usage) в формате send_message
+
+        Raises:
+            APIError: Если API недоступен после всех повторов или пакет ещё не обработан
+        """
+        batches = self.client.beta.messages.batches
+        entries = self._call_api(lambda: list(batches.results(batch_id)))
+
+        results = {}
+        for entry in entries:
+            if entry.result.type == 'succeeded':
+                results[entry.custom_id] = self._build_result(entry.result.message)
+            else:
+                error = getattr(entry.result, 'error', None)
+                detail = f": {error.error.message}" if error is not None else ""
+                logger.error(
+                    "Запрос %s пакета %s завершился со статусом %s%s",
+                    entry.custom_id, batch_id, entry.result.type, detail
+                )
+                results[entry.custom_id] = (
+                    None,
+                    {'error': f'Пакетный запрос завершился со статусом {entry.result.type}{detail}'},
+                    HTTP_INTERNAL_SERVER_ERROR,
+                    None
+                )
+        return results
+
+    @contextmanager
+    def stream_message(
+        self,
+        user_message: str,
+        output_format: str = OUTPUT_FORMAT_DEFAULT,
+        model: Optional[str] = None,
+        max_tokens: int = MAX_TOKENS,
+        spec_mode: bool = False,
+        conversation_history: Optional[List[Dict[str, str]]] = None,
+        temperature: float = 1.0
+    ) -> Iterator[MessageStream]:
+        """
+        Открывает потоковый запрос к Claude API.
+
+        Используется как контекстный менеджер: `stream.text_stream` отдаёт
+        фрагменты ответа по мере генерации, `stream.get_final_message()` —
+        итоговое сообщение с usage. Открытие потока повторяется при 429/5xx
+        и сетевых ошибках по _retry_policy; ошибки после начала генерации
+        не повторяются. Ошибки API выбрасываются как исключения
+        и могут быть преобразованы через handle_error.
+
+        Args совпадают с send_message.
+
+        Yields:
+            Поток ответа Anthropic SDK
+        """
+        api_params = self._build_api_params(
+            user_message, output_format, model, max_tokens,
+            spec_mode, conversation_history, temperature
+        )
+        stream = self._open_stream(api_params)
+        try:
+            yield stream
+        finally:
+            stream.close()
+            self._settle_stream(api_params, stream)
+
+    @asynccontextmanager
+    async def astream_message(
+        self,
+        user_message: str,
+        output_format: str = OUTPUT_FORMAT_DEFAULT,
+        model: Optional[str] = None,
+        max_tokens: int = MAX_TOKENS,
+        spec_mode: bool = False,
+        conversation_history: Optional[List[Dict[str, str]]] = None,
+        temperature: float = 1.0
+    ) -> AsyncIterator[AsyncMessageStream]:
+        """
+        Асинхронная версия stream_message.
+
+        Используется как асинхронный контекстный менеджер:
+        `async with client.astream_message(...) as stream:` и
+        `async for text in stream.text_stream`. Потоки идут через AsyncAnthropic
+        поверх HTTP/2 пула, поэтому несколько потоков из одного цикла событий
+        мультиплексируются по общим соединениям.
+
+        Args совпадают с send_message.
+
+        Yields:
+            Асинхронный поток ответа Anthropic SDK
+        """
+        api_params = self._build_api_params(
+            user_message, output_format, model, max_tokens,
+            spec_mode, conversation_history, temperature
+        )
+        stream = await self._aopen_stream(api_params)
+        try:
+            yield stream
+        finally:
+            await stream.close()
+            self._settle_stream(api_params, stream)
+
+    def _response_cache_key(self, api_params: Dict[str, Any], spec_mode: bool, temperature: float) -> Optional[str]:
+        """
+        Возвращает ключ кэша ответов или None, если запрос нельзя кэшировать.
+
+        Кэшируются только детерминированные запросы: при temperature > 0
+        и в spec mode повторный запрос должен давать новый ответ.
+        """
+        if spec_mode or temperature > 0:
+            return None
+        return self.response_cache.make_key(api_params)
+
+    def _get_cached_result(self, cache_key: Optional[str]) -> Optional[Tuple[str, None, int, Optional[Dict]]]:
+        """Возвращает результат send_message из кэша ответов, если он там есть."""
+        if cache_key is None:
+            return None
+        cached = self.response_cache.get(cache_key)
+        if cached is None:
+            return None
+        reply, usage = cached
+        logger.info("Ответ взят из кэша")
+        return reply, None, 200, {**usage, 'cached': True} if usage else usage
+
+    def _store_result(
+        self,
+        cache_key: Optional[str],
+        result: Tuple[Optional[str], Optional[Dict], int, Optional[Dict]]
+    ) -> Tuple[Optional[str], Optional[Dict], int, Optional[Dict]]:
+        """Сохраняет успешный результат send_message в кэш ответов и возвращает его."""
+        if cache_key is not None:
+            self.response_cache.set(cache_key, result[0], result[3])
+        return result
+
+    @_retry_policy
+    def _create(self, api_params: Dict[str, Any]) -> Any:
+        """Вызывает messages.create с повторами при 429/5xx и сетевых ошибках."""
+        self._wait_for_rate_limit(api_params)
+        try:
+            raw_response = self.client.messages.with_raw_response.create(**api_params)
+        except Exception:
+            self._settle_rate_limit(api_params, 0)
+            raise
+        message = raw_response.parse()
+        self._settle_rate_limit(api_params, _used_tokens(message.usage))
+        self._check_rate_limits(api_params['model'], raw_response.headers)
+        return message
+
+    @_retry_policy
+    def _call_api(self, func: Any, *args: Any, **kwargs: Any) -> Any:
+        """Вызывает метод Anthropic SDK с повторами при 429/5xx и сетевых ошибках."""
+        return func(*args, **kwargs)
+
+    @_retry_policy
+    def _open_stream(self, api_params: Dict[str, Any]) -> MessageStream:
+        """Открывает поток messages.stream с повторами при 429/5xx и сетевых ошибках."""
+        self._wait_for_rate_limit(api_params)
+        # Запрос уходит в __enter__ менеджера; поток закрывает вызывающий код
+        try:
+            return self.client.messages.stream(**api_params).__enter__()
+        except Exception:
+            self._settle_rate_limit(api_params, 0)
+            raise
+
+    @_retry_policy
+    async def _aopen_stream(self, api_params: Dict[str, Any]) -> AsyncMessageStream:
+        """Асинхронная версия _open_stream."""
+        await self._await_rate_limit(api_params)
+        try:
+            return await self.async_client.messages.stream(**api_params).__aenter__()
+        except Exception:
+            self._settle_rate_limit(api_params, 0)
+            raise
+
+    @_retry_policy
+    async def _acreate(self, api_params: Dict[str, Any]) -> Any:
+        """Асинхронная версия _create."""
+        await self._await_rate_limit(api_params)
+        try:
+            raw_response = await self.async_client.messages.with_raw_response.create(**api_params)
+        except Exception:
+            self._settle_rate_limit(api_params, 0)
+            raise
+        message = raw_response.parse()
+        self._settle_rate_limit(api_params, _used_tokens(message.usage))
+        self._check_rate_limits(api_params['model'], raw_response.headers)
+        return message
+
+    def _get_rate_limiters(self, model: str) -> Tuple[TokenBucket, TokenBucket]:
+        """
+        Возвращает ограничители RPM и TPM для модели, создавая их при первом запросе.
+
+        Args:
+            model: Идентификатор модели Claude
+
+        Returns:
+            Кортеж (ограничитель запросов, ограничитель токенов)
+        """
+        limiters = self.rate_limiters.get(model)
+        if limiters is None:
+            requests_per_minute = CLAUDE_REQUESTS_PER_MINUTE * self.rate_limit_share
+            tokens_per_minute = CLAUDE_TOKENS_PER_MINUTE * self.rate_limit_share
+            limiters = self.rate_limiters.setdefault(model, (
+                TokenBucket(requests_per_minute / 60, requests_per_minute),
+                TokenBucket(tokens_per_minute / 60, tokens_per_minute)
+            ))
+        return limiters
+
+    def _wait_for_rate_limit(self, api_params: Dict[str, Any]) -> None:
+        """
+        Ждёт, пока запрос уложится в клиентские лимиты RPM и TPM модели.
+
+        Args:
+            api_params: Параметры messages.create
+        """
+        request_limiter, token_limiter = self._get_rate_limiters(api_params['model'])
+        request_limiter.wait_for_token()
+        token_limiter.wait_for_token(_estimate_tokens(api_params))
+
+    async def _await_rate_limit(self, api_params: Dict[str, Any]) -> None:
+        """Асинхронная версия _wait_for_rate_limit, не блокирующая цикл событий."""
+        request_limiter, token_limiter = self._get_rate_limiters(api_params['model'])
+        await request_limiter.await_token()
+        await token_limiter.await_token(_estimate_tokens(api_params))
+
+    def _settle_rate_limit(self, api_params: Dict[str, Any], used_tokens: int) -> None:
+        """
+        Сверяет резерв TPM, сделанный по _estimate_tokens, с фактическим расходом.
+
+        Оценка включает max_tokens целиком, поэтому без сверки ведро теряло бы
+        неиспользованную часть ответа при каждом запросе. Неудачный запрос
+        (used_tokens=0) возвращает резерв полностью.
+
+        Args:
+            api_params: Параметры messages.create
+            used_tokens: Фактический расход токенов по usage ответа
+        """
+        _, token_limiter = self._get_rate_limiters(api_params['model'])
+        token_limiter.settle(_estimate_tokens(api_params), used_tokens)
+
+    def _settle_stream(self, api_params: Dict[str, Any], stream: Any) -> None:
+        """
+        Сверяет резерв TPM потокового запроса с usage последнего снимка сообщения.
+
+        Если поток закрыт до первого события, расход неизвестен и резерв остаётся.
+        """
+        try:
+            usage = stream.current_message_snapshot.usage
+        except AssertionError:
+            return
+        self._settle_rate_limit(api_params, _used_tokens(usage))
+
+    def _check_rate_limits(self, model: str, headers: httpx.Headers) -> None:
+        """
+        Подстраивает ограничители под лимиты из заголовков ответа и
+        предупреждает, когда остаток лимита токенов почти исчерпан.
+
+        Лимиты (*-limit) делятся между воркерами, а запас ведра не превышает
+        остатка аккаунта (*-remaining), который учитывает запросы всех воркеров.
+
+        Args:
+            model: Модель, которой был отправлен запрос
+            headers: Заголовки успешного ответа Claude API
+        """
+        request_limiter, token_limiter = self._get_rate_limiters(model)
+
+        request_limit = _header_int(headers, 'anthropic-ratelimit-requests-limit')
+        if request_limit:
+            share = request_limit * self.rate_limit_share
+            request_limiter.set_rate(share / 60, share)
+        remaining_requests = _header_int(headers, 'anthropic-ratelimit-requests-remaining')
+        if remaining_requests is not None:
+            request_limiter.clamp(remaining_requests)
+
+        token_limit = _header_int(headers, 'anthropic-ratelimit-tokens-limit')
+        if token_limit:
+            share = token_limit * self.rate_limit_share
+            token_limiter.set_rate(share / 60, share)
+        remaining_tokens = _header_int(headers, 'anthropic-ratelimit-tokens-remaining')
+        if remaining_tokens is not None:
+            token_limiter.clamp(remaining_tokens)
+
+        if token_limit and remaining_tokens is not None and remaining_tokens < token_limit * RATE_LIMIT_WARNING_RATIO:
+            logger.warning("Лимит токенов Claude API почти исчерпан: осталось %d из %d", remaining_tokens, token_limit)
+
+    @staticmethod
+    def _pick_model(output_format: str, spec_mode: bool, user_message_len: int) -> str:
+        """
+        Выбирает модель по сложности запроса.
+
+        Короткие запросы в обычном формате отправляются в быструю и дешёвую
+        CLAUDE_FAST_MODEL, а spec mode, структурированные форматы (JSON, XML)
+        и длинные сообщения — в основную CLAUDE_MODEL.
+
+        Args:
+            output_format: Формат вывода
+            spec_mode: Режим сбора уточняющих данных
+            user_message_len: Длина сообщения пользователя в символах
+
+        Returns:
+            Идентификатор модели Claude
+        """
+        if spec_mode or output_format != OUTPUT_FORMAT_DEFAULT or user_message_len > FAST_MODEL_MAX_MESSAGE_LENGTH:
+            return CLAUDE_MODEL
+        return CLAUDE_FAST_MODEL
+
+    def _build_api_params(
+        self,
+        user_message: str,
+        output_format: str = OUTPUT_FORMAT_DEFAULT,
+        model: Optional[str] = None,
+        max_tokens: int = MAX_TOKENS,
+        spec_mode: bool = False,
+        conversation_history: Optional[List[Dict[str, str]]] = None,
+        temperature: float = 1.0
+    ) -> Dict[str, Any]:
+        """
+        Формирует параметры запроса к messages API и логирует их.
+
+        Args:
+            Совпадают с аргументами send_message
+
+        Returns:
+            Словарь параметров для messages.create
+
+        Raises:
+            ValueError: Если не удалось получить системный промпт
+        """
+        # Валидация формата
+        if output_format not in VALID_OUTPUT_FORMATS:
+            logger.warning(f"Неподдерживаемый формат: {output_format}, используется default")
+            output_format = OUTPUT_FORMAT_DEFAULT
+
+        # Получаем системный промпт
+        try:
+            system_prompt = get_system_prompt(output_format, spec_mode)
+        except ValueError as e:
+            logger.error(f"Ошибка получения системного промпта: {str(e)}")
+            raise
+
+        # Получаем чистое сообщение пользователя
+        clean_user_message = get_user_message(user_message)
+
+        if model is None:
+            model = self._pick_model(output_format, spec_mode, len(clean_user_message))
+
+        # Формируем массив сообщений с историей. Сообщения, в которых уже
+        # только role и content, передаются как есть, остальные копируются
+        messages = [
+            msg if len(msg) == 2 else {"role": msg['role'], "content": msg['content']}
+            for msg in conversation_history or ()
+            if msg.get('role') in VALID_MESSAGE_ROLES and msg.get('content')
+        ]
+
+        # Последний ответ ассистента — точка ветвления диалога: помечаем его
+        # для кэширования, чтобы следующий запрос читал префикс истории из кэша
+        for i in range(len(messages) - 1, -1, -1):
+            if messages[i]['role'] == 'assistant':
+                messages[i] = _with_cache_control(messages[i])
+                break
+
+        # Добавляем текущее сообщение пользователя
+        messages.append({
+            "role": "user",
+            "content": clean_user_message
+        })
+
+        # Формируем параметры запроса (системный промпт помечаем для кэширования)
+        api_params = {
+            "model": model,
+            "max_tokens": max_tokens,
+            "system": [{
+                "type": "text",
+                "text": system_prompt,
+                "cache_control": {"type": "ephemeral"}
+            }],
+            "messages": messages,
+            "temperature": temperature
+        }
+
+        # Добавляем stop_sequences для spec mode
+        if spec_mode: api_params["stop_sequences"] = [SPEC_END_MARKER]
+
+        # === Детальное логирование параметров API запроса ===
+        # Превью сообщений строятся за O(длина истории), поэтому весь блок
+        # выполняется только если INFO действительно пишется в лог
+        if logger.isEnabledFor(logging.INFO):
             logger.info("=== Отправка запроса к Claude API ===")
-            logger.info(f"Модель: {model}")
-            logger.info(f"Max tokens: {max_tokens}")
-            logger.info(f"Temperature: {temperature}")
+            logger.info("Модель: %s", model)
+            logger.info("Max tokens: %s", max_tokens)
+            logger.info("Temperature: %s", temperature)
             # Логируем system prompt (первые 200 символов)
-            system_preview = system_prompt[:200] + "..." if len(system_prompt) > 200 else system_prompt
-            logger.info(f"System prompt ({len(system_prompt)} символов): \"{system_preview}\"")
+            logger.info("System prompt (%d символов): \"%s\"", len(system_prompt), preview(system_prompt, 200))
 
             # Логируем сообщения
-            logger.info(f"Сообщения ({len(messages)} шт.):")
+            logger.info("Сообщения (%d шт.):", len(messages))
             for i, msg in enumerate(messages, 1):
                 content = msg['content']
-                content_preview = content[:100] + "..." if len(content) > 100 else content
+                # Содержимое сообщения может быть списком текстовых блоков
+                if not isinstance(content, str):
+                    content = ''.join(block.get('text', '') for block in content)
                 # Убираем переносы строк для компактности
-                content_preview = content_preview.replace('\n', ' ').replace('\r', '')
-                logger.info(f"  [{i}] {msg['role']} ({len(content)} символов): \"{content_preview}\"")
+                content_preview = preview(content, 100).translate(_NEWLINE_TABLE)
+                logger.info("  [%d] %s (%d символов): \"%s\"", i, msg['role'], len(content), content_preview)
 
             if spec_mode:
-                logger.info(f"Stop sequences: {api_params.get('stop_sequences', [])}")
+                logger.info("Stop sequences: %s", api_params.get('stop_sequences', []))
             logger.info("=====================================")
 
-            # Отправляем запрос к API
-            message = self.client.messages.create(**api_params)
+        return api_params
+
+    def _build_result(self, message: Any) -> Tuple[Optional[str], Optional[Dict], int, Optional[Dict]]:
+        """
+        Извлекает текст ответа и usage из ответа Claude API.
 
-            # Извлекаем ответ
-            raw_reply = message.content[0].text
-            logger.info(f"Сырой ответ от Claude: {raw_reply[:MAX_REPLY_LOG_LENGTH]}...")
+        Args:
+            message: Ответ messages.create
+
+        Returns:
+            Кортеж (ответ, None, 200, usage) в формате send_message
+        """
+        # Извлекаем ответ
+        raw_reply = message.content[0].text
+        if logger.isEnabledFor(logging.INFO):
+            logger.info("Сырой ответ от Claude: %s", preview(raw_reply, MAX_REPLY_LOG_LENGTH))
 
-            # Извлекаем информацию о токенах
-            usage = {
-                'input_tokens': message.usage.input_tokens,
-                'output_tokens': message.usage.output_tokens
-            }
-            logger.info(f"Использовано токенов: input={usage['input_tokens']}, output={usage['output_tokens']}")
+        return raw_reply, None, 200, self.extract_usage(message)
 
-            return raw_reply, None, 200, usage
+    def extract_usage(self, message: Any) -> Dict[str, int]:
+        """
+        Извлекает информацию о токенах из ответа Claude API.
+
+        Args:
+            message: Ответ messages.create или финальное сообщение потока
+
+        Returns:
+            Словарь с model, input_tokens, output_tokens и, если API их вернул,
+            cache_creation_input_tokens и cache_read_input_tokens
+        """
+        usage = {
+            'model': message.model,
+            'input_tokens': message.usage.input_tokens,
+            'output_tokens': message.usage.output_tokens
+        }
+        # Поля кэша промптов приходят только с beta заголовком prompt caching
+        for field in ('cache_creation_input_tokens', 'cache_read_input_tokens'):
+            value = getattr(message.usage, field, None)
+            if value is not None:
+                usage[field] = value
+        logger.info(
+            "Использовано токенов: input=%d, output=%d, cache_write=%d, cache_read=%d",
+            usage['input_tokens'], usage['output_tokens'],
+            usage.get('cache_creation_input_tokens', 0), usage.get('cache_read_input_tokens', 0)
+        )
+        return usage
+
+    def handle_error(self, e: Exception) -> Tuple[None, Dict, int, None]:
+        """
+        Преобразует исключение при обращении к Claude API в ответ send_message.
 
-        except AuthenticationError as e:
-            logger.error(f"Ошибка аутентификации API: {e}\n{traceback.format_exc()}")
+        Args:
+            e: Перехваченное исключение
+
+        Returns:
+            Кортеж (None, ошибка, HTTP код, None) в формате send_message
+        """
+        if isinstance(e, ValueError):
+            return None, {'error': str(e)}, HTTP_INTERNAL_SERVER_ERROR, None
+
+        if isinstance(e, AuthenticationError):
+            logger.error("Ошибка аутентификации API: %s", e, exc_info=e)
             return None, {'error': ERROR_INVALID_API_KEY}, HTTP_INTERNAL_SERVER_ERROR, None
 
-        except RateLimitError as e:
-            logger.error(f"Превышен лимит запросов: {e}\n{traceback.format_exc()}")
+        if isinstance(e, RateLimitError):
+            logger.error("Превышен лимит запросов: %s", e, exc_info=e)
             return None, {'error': ERROR_RATE_LIMIT}, HTTP_TOO_MANY_REQUESTS, None
 
-        except APIConnectionError as e:
-            logger.error(f"Ошибка соединения с API: {e}\n{traceback.format_exc()}")
+        if isinstance(e, APIConnectionError):
+            logger.error("Ошибка соединения с API: %s", e, exc_info=e)
             return None, {'error': ERROR_CONNECTION}, HTTP_SERVICE_UNAVAILABLE, None
 
-        except APIError as e:
-            logger.error(f"Ошибка Claude API: {e}\n{traceback.format_exc()}")
+        if isinstance(e, APIError):
+            logger.error("Ошибка Claude API: %s", e, exc_info=e)
             return None, {'error': f'Ошибка Claude API: {str(e)}'}, HTTP_INTERNAL_SERVER_ERROR, None
 
-        except Exception as e:
-            logger.error(f"Неожиданная ошибка: {e}\n{traceback.format_exc()}")
-            return None, {'error': f'Ошибка сервера: {str(e)}'}, HTTP_INTERNAL_SERVER_ERROR, None
-    
+        logger.error("Неожиданная ошибка: %s", e, exc_info=e)
+        return None, {'error': f'Ошибка сервера: {str(e)}'}, HTTP_INTERNAL_SERVER_ERROR, None
+
     def is_api_key_configured(self) -> bool:
         return bool(self.api_key)
 
+    def close(self) -> None:
+        """
+        Освобождает собственные ресурсы клиента: пул потоков send_many
+        и HTTP пул асинхронного клиента.
+
+        Общий синхронный клиент не закрывается — им пользуются другие модули,
+        его закрывает close_anthropic_clients при завершении процесса.
+        Внутри работающего цикла событий используйте aclose.
+        """
+        try:
+            asyncio.get_running_loop()
+        except RuntimeError:
+            asyncio.run(self.aclose())
+            return
+        raise RuntimeError("close() нельзя вызывать из работающего цикла событий, используйте aclose()")
+
+    async def aclose(self) -> None:
+        """Асинхронная версия close."""
+        self.executor.shutdown(wait=False, cancel_futures=True)
+        try:
+            await self.async_client.close()
+        except Exception as e:
+            logger.warning("Не удалось закрыть AsyncAnthropic клиент: %s", e)
+        logger.info("Ресурсы Claude клиента освобождены")
+
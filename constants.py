@@ -12,18 +12,62 @@ DEBUG_MODE = False
 
 # Настройки Claude API
 CLAUDE_MODEL = "claude-sonnet-4-20250514"
+CLAUDE_FAST_MODEL = "claude-3-5-haiku-20241022"  # Модель для простых запросов в обычном формате
+FAST_MODEL_MAX_MESSAGE_LENGTH = 2000  # Сообщения длиннее этого (в символах) всегда уходят в CLAUDE_MODEL
 MAX_TOKENS = 1024
+MIN_MAX_TOKENS = 128
+MAX_MAX_TOKENS = 4096
+DEFAULT_TEMPERATURE = 1.0
+MIN_TEMPERATURE = 0.0
+MAX_TEMPERATURE = 1.0
+
+# HTTP пул соединений с Claude API (таймауты в секундах)
+CLAUDE_CONNECT_TIMEOUT = 5.0
+CLAUDE_READ_TIMEOUT = 60.0
+CLAUDE_WRITE_TIMEOUT = 10.0
+CLAUDE_POOL_TIMEOUT = 5.0
+CLAUDE_MAX_CONNECTIONS = 256
+CLAUDE_MAX_KEEPALIVE_CONNECTIONS = 128
+CLAUDE_KEEPALIVE_EXPIRY = 30.0
+
+# Повторы запросов к Claude API при 429/5xx и сетевых ошибках (паузы в секундах)
+CLAUDE_RETRY_ATTEMPTS = 4
+CLAUDE_RETRY_MIN_WAIT = 2
+CLAUDE_RETRY_MAX_WAIT = 60
+RATE_LIMIT_WARNING_RATIO = 0.1  # Предупреждать, когда остаток лимита токенов меньше этой доли
+
+# Клиентский ограничитель частоты запросов (начальные лимиты до получения заголовков anthropic-ratelimit-*)
+CLAUDE_REQUESTS_PER_MINUTE = 50
+CLAUDE_TOKENS_PER_MINUTE = 40_000
+CHARS_PER_TOKEN_ESTIMATE = 4  # Средняя длина токена в символах для оценки расхода TPM
+
+# Параллельные запросы send_many (переопределяется переменной окружения CLAUDE_MAX_CONCURRENCY)
+CLAUDE_MAX_CONCURRENCY = 16
+
+# Message Batches API
+MESSAGE_BATCH_POLL_INTERVAL = 30  # Пауза между проверками статуса пакета (секунды)
+MESSAGE_BATCH_MAX_WAIT = 24 * 3600  # Максимальное время ожидания обработки пакета (секунды)
+
+# Кэш ответов Claude API (только детерминированные запросы с temperature=0)
+RESPONSE_CACHE_MAX_SIZE = 10_000
+RESPONSE_CACHE_TTL = 3600  # Время жизни ответа в кэше (секунды)
+
+# Кэширование промптов Claude API
+PROMPT_CACHING_BETA = 'prompt-caching-2024-07-31'
 
 # Форматы вывода
 OUTPUT_FORMAT_DEFAULT = 'default'
 OUTPUT_FORMAT_JSON = 'json'
 OUTPUT_FORMAT_XML = 'xml'
 
-VALID_OUTPUT_FORMATS = [
+VALID_OUTPUT_FORMATS = frozenset({
     OUTPUT_FORMAT_DEFAULT,
     OUTPUT_FORMAT_JSON,
     OUTPUT_FORMAT_XML
-]
+})
+
+# Роли сообщений диалога, которые передаются в Claude API
+VALID_MESSAGE_ROLES = frozenset({'user', 'assistant'})
 
 # Настройки логирования
 LOG_FILE = 'app.log'
@@ -34,6 +78,10 @@ LOG_LEVEL = 'INFO'
 STATIC_FOLDER = 'public'
 STATIC_URL_PATH = ''
 INDEX_FILE = 'index.html'
+INDEX_CACHE_MAX_AGE = 60  # Время кэширования главной страницы браузером (секунды)
+
+# MIME типы
+MIMETYPE_MSGPACK = 'application/vnd.msgpack'
 
 # HTTP коды ответов
 HTTP_OK = 200
@@ -41,9 +89,11 @@ HTTP_BAD_REQUEST = 400
 HTTP_TOO_MANY_REQUESTS = 429
 HTTP_INTERNAL_SERVER_ERROR = 500
 HTTP_SERVICE_UNAVAILABLE = 503
+HTTP_GATEWAY_TIMEOUT = 504
 
 # Сообщения об ошибках
 ERROR_EMPTY_MESSAGE = 'Пустое сообщение'
+ERROR_INVALID_REQUEST = 'Некорректный формат запроса'
 ERROR_INVALID_API_KEY = 'Неверный API ключ Claude'
 ERROR_RATE_LIMIT = 'Превышен лимит запросов к Claude API'
 ERROR_CONNECTION = 'Не удалось подключиться к Claude API'
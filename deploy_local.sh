@@ -76,6 +76,26 @@ check_local_files() {
               missing_files+=("history_compression.py")
     fi
 
+    if [ ! -f "json_provider.py" ]; then
+        missing_files+=("json_provider.py")
+    fi
+
+    if [ ! -f "schemas.py" ]; then
+        missing_files+=("schemas.py")
+    fi
+
+    if [ ! -f "gunicorn.conf.py" ]; then
+        missing_files+=("gunicorn.conf.py")
+    fi
+
+    if [ ! -f "response_cache.py" ]; then
+        missing_files+=("response_cache.py")
+    fi
+
+    if [ ! -f "rate_limiter.py" ]; then
+        missing_files+=("rate_limiter.py")
+    fi
+
     # Фронтенд
     if [ ! -f "public/index.html" ]; then
         missing_files+=("public/index.html")
@@ -165,6 +185,41 @@ deploy_files() {
         exit 1
     fi
 
+    if scp -q json_provider.py ${SERVER}:${REMOTE_DIR}/; then
+        print_success "json_provider.py скопирован"
+    else
+        print_error "Ошибка копирования json_provider.py"
+        exit 1
+    fi
+
+    if scp -q schemas.py ${SERVER}:${REMOTE_DIR}/; then
+        print_success "schemas.py скопирован"
+    else
+        print_error "Ошибка копирования schemas.py"
+        exit 1
+    fi
+
+    if scp -q gunicorn.conf.py ${SERVER}:${REMOTE_DIR}/; then
+        print_success "gunicorn.conf.py скопирован"
+    else
+        print_error "Ошибка копирования gunicorn.conf.py"
+        exit 1
+    fi
+
+    if scp -q response_cache.py ${SERVER}:${REMOTE_DIR}/; then
+        print_success "response_cache.py скопирован"
+    else
+        print_error "Ошибка копирования response_cache.py"
+        exit 1
+    fi
+
+    if scp -q rate_limiter.py ${SERVER}:${REMOTE_DIR}/; then
+        print_success "rate_limiter.py скопирован"
+    else
+        print_error "Ошибка копирования rate_limiter.py"
+        exit 1
+    fi
+
     # Копируем .env
     if scp -q .env ${SERVER}:${REMOTE_DIR}/; then
         print_success ".env скопирован"
@@ -369,7 +424,8 @@ main() {
 
     print_header "Деплой завершен успешно!"
     print_info "Сервер доступен по адресу: http://95.217.187.167:8000"
-    print_info "Все модули Python обновлены: App.py, constants.py, prompts.py, logger.py, claude_client.py"
+    print_info "Все модули Python обновлены: App.py, constants.py, prompts.py, logger.py, claude_client.py, json_provider.py, schemas.py, response_cache.py, rate_limiter.py"
+    print_info "Конфигурация Gunicorn обновлена: gunicorn.conf.py"
     print_info "Все форматы вывода протестированы: default, json, xml"
 }
 
@@ -0,0 +1,28 @@
+"""
+Конфигурация Gunicorn для продакшн запуска.
+
+Запуск: gunicorn -c gunicorn.conf.py App:app
+
+Используются асинхронные gevent воркеры: пока запрос ждёт ответа
+Claude API, воркер продолжает обслуживать другие соединения.
+"""
+
+import os
+
+from constants import DEFAULT_HOST, DEFAULT_PORT
+
+bind = f"{DEFAULT_HOST}:{os.environ.get('PORT', DEFAULT_PORT)}"
+worker_class = 'gevent'
+workers = 2 * (os.cpu_count() or 1) + 1
+worker_connections = 1000
+timeout = 120
+
+
+def post_fork(server, worker):
+    """
+    Сообщает воркеру итоговое количество воркеров (с учётом флага -w).
+
+    ClaudeClient делит лимиты Claude API на WEB_CONCURRENCY, чтобы
+    воркеры вместе не превышали лимит аккаунта.
+    """
+    os.environ['WEB_CONCURRENCY'] = str(server.cfg.workers)
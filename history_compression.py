@@ -5,18 +5,20 @@
 каждые N сообщений, заменяя старые сообщения на краткий summary.
 """
 
+import logging
 import os
 from typing import List, Dict, Optional
-from anthropic import Anthropic
 
 from constants import (
     CLAUDE_MODEL,
     MAX_TOKENS,
     COMPRESSION_THRESHOLD,
     COMPRESSION_KEEP_RECENT,
-    COMPRESSION_SUMMARY_MAX_TOKENS
+    COMPRESSION_SUMMARY_MAX_TOKENS,
+    VALID_MESSAGE_ROLES
 )
-from logger import get_logger
+from claude_client import get_anthropic_client
+from logger import get_logger, preview
 
 logger = get_logger(__name__)
 
@@ -42,7 +44,7 @@ class HistoryCompressor:
             logger.error("API ключ не найден для HistoryCompressor")
             raise ValueError("ANTHROPIC_API_KEY не установлен")
 
-        self.client = Anthropic(api_key=self.api_key)
+        self.client = get_anthropic_client(self.api_key)
         logger.info("HistoryCompressor инициализирован")
 
     def should_compress(self, history: List[Dict[str, str]]) -> bool:
@@ -55,10 +57,15 @@ class HistoryCompressor:
         Returns:
             True если нужно сжать, False иначе
         """
+        # Общая длина истории — верхняя граница числа диалоговых сообщений,
+        # поэтому короткие истории не сканируем
+        if len(history) < COMPRESSION_THRESHOLD:
+            return False
+
         # Считаем только сообщения user и assistant
         message_count = sum(
             1 for msg in history
-            if msg.get('role') in ('user', 'assistant')
+            if msg.get('role') in VALID_MESSAGE_ROLES
         )
 
         should_compress = message_count >= COMPRESSION_THRESHOLD
@@ -108,7 +115,8 @@ class HistoryCompressor:
             summary = response.content[0].text.strip()
 
             logger.info(f"Summary создан успешно: {len(summary)} символов")
-            logger.debug(f"Summary: {summary[:200]}...")
+            if logger.isEnabledFor(logging.DEBUG):
+                logger.debug("Summary: %s", preview(summary, 200))
 
             return summary
 
@@ -143,7 +151,7 @@ class HistoryCompressor:
         # Фильтруем только user/assistant сообщения
         dialog_messages = [
             msg for msg in history
-            if msg.get('role') in ('user', 'assistant')
+            if msg.get('role') in VALID_MESSAGE_ROLES
         ]
 
         if len(dialog_messages) < keep_recent:
@@ -186,11 +194,8 @@ class HistoryCompressor:
         lines = []
         for i, msg in enumerate(messages, 1):
             role = msg.get('role', 'unknown')
-            content = msg.get('content', '')
-
             # Ограничиваем длину каждого сообщения
-            if len(content) > 500:
-                content = content[:500] + "..."
+            content = preview(msg.get('content', ''), 500)
 
             role_label = "Пользователь" if role == "user" else "Ассистент"
             lines.append(f"[{i}] {role_label}: {content}")
@@ -231,7 +236,7 @@ class HistoryCompressor:
         """
         dialog_messages = [
             msg for msg in history
-            if msg.get('role') in ('user', 'assistant')
+            if msg.get('role') in VALID_MESSAGE_ROLES
         ]
 
         total_chars = sum(len(msg.get('content', '')) for msg in dialog_messages)
@@ -0,0 +1,81 @@
+"""
+JSON провайдер Flask на основе orjson.
+
+Этот модуль заменяет стандартный json-провайдер Flask на orjson,
+который быстрее разбирает запросы и сериализует ответы.
+"""
+
+from typing import Any, Union
+
+import orjson
+from flask import Response
+from flask.json.provider import DefaultJSONProvider
+
+
+class OrjsonProvider(DefaultJSONProvider):
+    """
+    JSON провайдер, использующий orjson для dumps/loads.
+
+    Подключается через `app.json = OrjsonProvider(app)`, после чего
+    `jsonify(...)` и `request.get_json()` работают через orjson.
+
+    orjson всегда пишет UTF-8 без \\uXXXX экранирования, поэтому ensure_ascii
+    игнорируется. Ключи по умолчанию не сортируются.
+    """
+
+    sort_keys = False
+    ensure_ascii = False
+    compact = True
+
+    def _options(self, sort_keys: bool, indent: bool) -> int:
+        """Собирает флаги orjson из настроек провайдера."""
+        option = orjson.OPT_NON_STR_KEYS
+        if sort_keys:
+            option |= orjson.OPT_SORT_KEYS
+        if indent:
+            option |= orjson.OPT_INDENT_2
+        return option
+
+    def dumps(self, obj: Any, **kwargs: Any) -> str:
+        """
+        Сериализует объект в JSON строку.
+
+        Args:
+            obj: Объект для сериализации
+            **kwargs: Аргументы стандартного провайдера (учитываются default, sort_keys, indent)
+
+        Returns:
+            JSON строка
+        """
+        return orjson.dumps(
+            obj,
+            default=kwargs.get('default', self.default),
+            option=self._options(kwargs.get('sort_keys', self.sort_keys), bool(kwargs.get('indent')))
+        ).decode()
+
+    def loads(self, s: Union[str, bytes], **kwargs: Any) -> Any:
+        """
+        Десериализует JSON строку или байты.
+
+        Args:
+            s: JSON строка или байты
+            **kwargs: Аргументы стандартного провайдера (игнорируются)
+
+        Returns:
+            Десериализованный объект
+        """
+        return orjson.loads(s)
+
+    def response(self, *args: Any, **kwargs: Any) -> Response:
+        """
+        Сериализует аргументы в JSON ответ.
+
+        В отличие от стандартного провайдера байты orjson передаются
+        в ответ напрямую, без промежуточной строки.
+        """
+        obj = self._prepare_response_obj(args, kwargs)
+        indent = (self.compact is None and self._app.debug) or self.compact is False
+        return self._app.response_class(
+            orjson.dumps(obj, default=self.default, option=self._options(self.sort_keys, indent)),
+            mimetype=self.mimetype
+        )
@@ -55,3 +55,20 @@ def get_logger(name: Optional[str] = None) -> logging.Logger:
     """
     return logging.getLogger(name or __name__)
 
+
+def preview(text: str, limit: int) -> str:
+    """
+    Возвращает превью текста для логов.
+
+    Короткий текст возвращается без копирования и без многоточия,
+    длинный обрезается до limit символов с "..." в конце.
+
+    Args:
+        text: Исходный текст
+        limit: Максимальная длина превью без многоточия
+
+    Returns:
+        Текст или его обрезанная версия
+    """
+    return text if len(text) <= limit else f"{text[:limit]}..."
+
@@ -10,7 +10,7 @@
 - messages[].role="assistant": Ответы Claude
 """
 
-from constants import OUTPUT_FORMAT_DEFAULT, OUTPUT_FORMAT_JSON, OUTPUT_FORMAT_XML
+from constants import OUTPUT_FORMAT_DEFAULT, OUTPUT_FORMAT_JSON, OUTPUT_FORMAT_XML, VALID_OUTPUT_FORMATS
 
 
 class SystemPrompts:
@@ -113,20 +113,24 @@ class SystemPrompts:
 # Disabled Маркер конца результата для spec mode
 SPEC_END_MARKER = "---END_RESULT---"
 
+# Инструкции по формату для каждого поддерживаемого формата вывода
+_FORMAT_INSTRUCTIONS = {
+    OUTPUT_FORMAT_DEFAULT: SystemPrompts.OutputFormat.DEFAULT,
+    OUTPUT_FORMAT_JSON: SystemPrompts.OutputFormat.JSON,
+    OUTPUT_FORMAT_XML: SystemPrompts.OutputFormat.XML,
+}
 
-def get_system_prompt(output_format: str, spec_mode: bool = False) -> str:
-    """
-    Возвращает системный промпт для Claude API.
 
+def _build_system_prompt(output_format: str, spec_mode: bool) -> str:
+    """
     Склеивает базовый промпт (в зависимости от режима) с инструкциями по формату.
-    Передается в параметр `system` при вызове API.
 
     Args:
         output_format: Формат вывода ('default', 'json', 'xml')
         spec_mode: Режим сбора уточняющих данных (True/False)
 
     Returns:
-        Склеенный системный промпт для Claude API
+        Склеенный системный промпт
 
     Raises:
         ValueError: Если указан неподдерживаемый формат
@@ -138,14 +142,10 @@ def get_system_prompt(output_format: str, spec_mode: bool = False) -> str:
         base_prompt = SystemPrompts.SpecMode.DEFAULT
 
     # Выбираем инструкции по формату
-    if output_format == OUTPUT_FORMAT_DEFAULT:
-        format_instructions = SystemPrompts.OutputFormat.DEFAULT
-    elif output_format == OUTPUT_FORMAT_JSON:
-        format_instructions = SystemPrompts.OutputFormat.JSON
-    elif output_format == OUTPUT_FORMAT_XML:
-        format_instructions = SystemPrompts.OutputFormat.XML
-    else:
-        raise ValueError(f"Неподдерживаемый формат вывода: {output_format}")
+    try:
+        format_instructions = _FORMAT_INSTRUCTIONS[output_format]
+    except KeyError:
+        raise ValueError(f"Неподдерживаемый формат вывода: {output_format}") from None
 
     # Склеиваем промпты
     if format_instructions:
@@ -154,12 +154,45 @@ def get_system_prompt(output_format: str, spec_mode: bool = False) -> str:
         return base_prompt
 
 
+# Все системные промпты статичны, поэтому собираются один раз при импорте
+_SYSTEM_PROMPTS = {
+    (output_format, spec_mode): _build_system_prompt(output_format, spec_mode)
+    for output_format in VALID_OUTPUT_FORMATS
+    for spec_mode in (False, True)
+}
+
+
+def get_system_prompt(output_format: str, spec_mode: bool = False) -> str:
+    """
+    Возвращает системный промпт для Claude API.
+
+    Промпты для всех комбинаций (формат, режим) собраны заранее,
+    так что вызов сводится к поиску в словаре.
+    Передается в параметр `system` при вызове API.
+
+    Args:
+        output_format: Формат вывода ('default', 'json', 'xml')
+        spec_mode: Режим сбора уточняющих данных (True/False)
+
+    Returns:
+        Склеенный системный промпт для Claude API
+
+    Raises:
+        ValueError: Если указан неподдерживаемый формат
+    """
+    try:
+        return _SYSTEM_PROMPTS[(output_format, bool(spec_mode))]
+    except KeyError:
+        raise ValueError(f"Неподдерживаемый формат вывода: {output_format}") from None
+
+
 def get_user_message(user_message: str) -> str:
     """
     Возвращает сообщение пользователя для передачи в messages[].
 
     Сообщение передается без дополнительных инструкций,
     так как все инструкции находятся в системном промпте.
+    Для уже обрезанной строки strip() возвращает её же без копирования.
 
     Args:
         user_message: Исходное сообщение пользователя
@@ -0,0 +1,143 @@
+"""
+Клиентский ограничитель частоты запросов к Claude API.
+
+Этот модуль реализует алгоритм token bucket: запросы ждут, пока в
+ведре накопится нужное количество токенов, вместо того чтобы все
+одновременно упереться в лимиты RPM/TPM и получить 429.
+"""
+
+import asyncio
+import threading
+import time
+
+from logger import get_logger
+
+logger = get_logger(__name__)
+
+
+class TokenBucket:
+    """
+    Потокобезопасное ведро токенов с резервированием.
+
+    Токены пополняются со скоростью tokens_per_second до max_tokens.
+    Запрос сразу резервирует нужное количество токенов (баланс может
+    уйти в минус) и получает паузу, через которую резерв будет покрыт,
+    поэтому ожидающие запросы обслуживаются в порядке поступления.
+
+    Ведро действует в пределах процесса, поэтому при нескольких воркерах
+    gunicorn вызывающий код должен делить лимит между ними.
+
+    Attributes:
+        tokens_per_second: Скорость пополнения ведра
+        max_tokens: Вместимость ведра
+    """
+
+    def __init__(self, tokens_per_second: float, max_tokens: float):
+        """
+        Инициализирует ведро токенов, заполненное до max_tokens.
+
+        Args:
+            tokens_per_second: Скорость пополнения ведра
+            max_tokens: Вместимость ведра
+        """
+        self.tokens_per_second = tokens_per_second
+        self.max_tokens = max_tokens
+        self._tokens = max_tokens
+        self._updated_at = time.monotonic()
+        self._lock = threading.Lock()
+
+    def set_rate(self, tokens_per_second: float, max_tokens: float) -> None:
+        """
+        Обновляет скорость пополнения и вместимость ведра.
+
+        Args:
+            tokens_per_second: Новая скорость пополнения ведра
+            max_tokens: Новая вместимость ведра
+        """
+        with self._lock:
+            if tokens_per_second == self.tokens_per_second and max_tokens == self.max_tokens:
+                return
+            self._refill()
+            self.tokens_per_second = tokens_per_second
+            self.max_tokens = max_tokens
+            self._tokens = min(self._tokens, max_tokens)
+        logger.info("Лимит обновлён: %.2f токенов/с, вместимость %s", tokens_per_second, max_tokens)
+
+    def clamp(self, available: float) -> None:
+        """
+        Ограничивает текущий запас ведра сверху.
+
+        Используется, чтобы ведро не обещало больше, чем реально осталось
+        по лимиту аккаунта (например, по заголовкам *-remaining).
+
+        Args:
+            available: Максимально допустимый запас токенов
+        """
+        with self._lock:
+            self._refill()
+            self._tokens = min(self._tokens, available)
+
+    def reserve(self, tokens: float = 1) -> float:
+        """
+        Резервирует токены и возвращает паузу до их появления.
+
+        Запрос больше вместимости ведра резервирует всю вместимость,
+        иначе он никогда не был бы выполнен.
+
+        Args:
+            tokens: Количество токенов
+
+        Returns:
+            Пауза в секундах (0, если токенов достаточно)
+        """
+        with self._lock:
+            self._refill()
+            self._tokens -= min(tokens, self.max_tokens)
+            if self._tokens >= 0:
+                return 0.0
+            return -self._tokens / self.tokens_per_second
+
+    def settle(self, reserved: float, used: float) -> None:
+        """
+        Сверяет резерв с фактическим расходом.
+
+        Неиспользованная часть резерва возвращается в ведро, а перерасход
+        списывается дополнительно.
+
+        Args:
+            reserved: Количество токенов, переданное в reserve
+            used: Фактически израсходованное количество токенов
+        """
+        with self._lock:
+            self._refill()
+            self._tokens = min(self.max_tokens, self._tokens + min(reserved, self.max_tokens) - used)
+
+    def wait_for_token(self, tokens: float = 1) -> None:
+        """
+        Блокирует поток, пока не появятся нужные токены.
+
+        Args:
+            tokens: Количество токенов
+        """
+        delay = self.reserve(tokens)
+        if delay > 0:
+            logger.info("Ожидание лимита запросов: %.2f с", delay)
+            time.sleep(delay)
+
+    async def await_token(self, tokens: float = 1) -> None:
+        """
+        Асинхронная версия wait_for_token, не блокирующая цикл событий.
+
+        Args:
+            tokens: Количество токенов
+        """
+        delay = self.reserve(tokens)
+        if delay > 0:
+            logger.info("Ожидание лимита запросов: %.2f с", delay)
+            await asyncio.sleep(delay)
+
+    def _refill(self) -> None:
+        """Пополняет ведро за время, прошедшее с прошлого обращения. Вызывается под блокировкой."""
+        now = time.monotonic()
+        self._tokens = min(self.max_tokens, self._tokens + (now - self._updated_at) * self.tokens_per_second)
+        self._updated_at = now
@@ -0,0 +1,81 @@
+"""
+Кэш ответов Claude API.
+
+Этот модуль хранит ответы на полностью совпадающие запросы
+(системный промпт, сообщения, модель и параметры генерации),
+чтобы повторные запросы не отправлялись в API.
+"""
+
+import hashlib
+import threading
+from typing import Any, Dict, Optional, Tuple
+
+import orjson
+from cachetools import TTLCache
+
+from constants import RESPONSE_CACHE_MAX_SIZE, RESPONSE_CACHE_TTL
+from logger import get_logger
+
+logger = get_logger(__name__)
+
+
+class ResponseCache:
+    """
+    Потокобезопасный TTL кэш ответов по SHA256 параметров запроса.
+
+    Attributes:
+        maxsize: Максимальное количество ответов в кэше
+        ttl: Время жизни ответа в секундах
+    """
+
+    def __init__(self, maxsize: int = RESPONSE_CACHE_MAX_SIZE, ttl: int = RESPONSE_CACHE_TTL):
+        """
+        Инициализирует кэш ответов.
+
+        Args:
+            maxsize: Максимальное количество ответов в кэше
+            ttl: Время жизни ответа в секундах
+        """
+        self.maxsize = maxsize
+        self.ttl = ttl
+        self._cache: TTLCache = TTLCache(maxsize=maxsize, ttl=ttl)
+        self._lock = threading.Lock()
+
+    @staticmethod
+    def make_key(api_params: Dict[str, Any]) -> str:
+        """
+        Строит ключ кэша из параметров запроса к messages API.
+
+        Args:
+            api_params: Параметры messages.create
+
+        Returns:
+            SHA256 хэш параметров в hex виде
+        """
+        return hashlib.sha256(orjson.dumps(api_params, option=orjson.OPT_SORT_KEYS)).hexdigest()
+
+    def get(self, key: str) -> Optional[Tuple[str, Dict[str, Any]]]:
+        """
+        Возвращает закэшированный ответ.
+
+        Args:
+            key: Ключ кэша
+
+        Returns:
+            Кортеж (ответ, usage) или None, если ответа нет в кэше
+        """
+        with self._lock:
+            return self._cache.get(key)
+
+    def set(self, key: str, reply: str, usage: Optional[Dict[str, Any]]) -> None:
+        """
+        Сохраняет ответ в кэш.
+
+        Args:
+            key: Ключ кэша
+            reply: Текст ответа Claude
+            usage: Информация о токенах исходного запроса
+        """
+        with self._lock:
+            self._cache[key] = (reply, usage)
+        logger.debug("Ответ сохранён в кэш: %.12s", key)
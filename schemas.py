@@ -0,0 +1,33 @@
+"""
+Схемы запросов API.
+
+Этот модуль содержит msgspec-структуры, в которые напрямую
+декодируется тело запросов к API приложения.
+"""
+
+from typing import Any, Dict, List
+
+import msgspec
+
+from constants import MAX_TOKENS, DEFAULT_TEMPERATURE, OUTPUT_FORMAT_DEFAULT
+
+
+class ChatRequest(msgspec.Struct):
+    """
+    Тело запроса к /api/chat.
+
+    Attributes:
+        message: Сообщение пользователя
+        output_format: Формат вывода ('default', 'json', 'xml')
+        max_tokens: Максимальное количество токенов в ответе
+        temperature: Температура генерации
+        spec_mode: Режим сбора уточняющих данных
+        conversation_history: История диалога
+    """
+
+    message: str = ''
+    output_format: str = OUTPUT_FORMAT_DEFAULT
+    max_tokens: int = MAX_TOKENS
+    temperature: float = DEFAULT_TEMPERATURE
+    spec_mode: bool = False
+    conversation_history: List[Dict[str, Any]] = []
@@ -7,11 +7,9 @@
 
 import os
 import logging
-import traceback
 from typing import List, Dict, Optional
 
-from anthropic import Anthropic
-
+from claude_client import get_anthropic_client
 from constants import CLAUDE_MODEL
 
 # Настройка логирования
@@ -35,7 +33,7 @@ class TokenCounter:
             raise ValueError("ANTHROPIC_API_KEY не установлен")
 
         logger.info(f"TokenCounter: API ключ найден: {self.api_key[:10]}...{self.api_key[-4:]}")
-        self.client = Anthropic(api_key=self.api_key)
+        self.client = get_anthropic_client(self.api_key)
         logger.info("TokenCounter: Anthropic клиент создан успешно")
 
     def count_tokens(
@@ -84,7 +82,6 @@ class TokenCounter:
         except Exception as e:
             logger.error(f"=== Ошибка в count_tokens() ===")
             logger.error(f"Тип ошибки: {type(e).__name__}")
-            logger.error(f"Сообщение: {str(e)}")
-            logger.error(f"Traceback:\n{traceback.format_exc()}")
+            logger.exception(f"Сообщение: {str(e)}")
             raise
 